@@ -1,7 +1,16 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response
 from flask_mysqldb import MySQL
+from MySQLdb.cursors import Cursor
 from werkzeug.security import check_password_hash, generate_password_hash
 import os
+import csv
+import io
+import json
+import re
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from functools import wraps
 
@@ -20,6 +29,160 @@ app.config['MYSQL_PORT'] = int(os.getenv('MYSQL_PORT', 3306))
 
 mysql = MySQL(app)
 
+# Background jobs configuration
+app.config['JOBS_MAX_WORKERS'] = int(os.getenv('JOBS_MAX_WORKERS', 2))
+app.config['JOBS_BATCH_SIZE'] = int(os.getenv('JOBS_BATCH_SIZE', 500))
+# Pause after each batch (seconds); only set in tests so jobs stay cancellable
+app.config['JOBS_BATCH_DELAY'] = float(os.getenv('JOBS_BATCH_DELAY', 0))
+
+# Bounded pool: heavy operations run here instead of inside request handlers
+job_executor = ThreadPoolExecutor(
+    max_workers=app.config['JOBS_MAX_WORKERS'],
+    thread_name_prefix='job-worker'
+)
+
+# Query observability configuration
+app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', 200))
+app.config['QUERY_EXPLAIN'] = os.getenv('QUERY_EXPLAIN', 'false').lower() in ['1', 'true', 'yes']
+app.config['QUERY_EXPLAIN_ATTEMPTS'] = 3
+
+
+# =============================================================================
+# Query observability
+# =============================================================================
+
+# Per-fingerprint statistics, shared by request handlers and job workers
+query_stats = {}
+query_stats_lock = threading.Lock()
+
+
+def fingerprint_query(query):
+    """Normalize a statement (literals and placeholders -> ?) and return (fingerprint, normalized)"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', errors='replace')
+    normalized = re.sub(r"'(?:[^'\\]|\\.|'')*'", '?', query)
+    normalized = re.sub(r'%s|\b\d+\b', '?', normalized)
+    normalized = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?+)', normalized)
+    normalized = ' '.join(normalized.split())
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12], normalized
+
+
+def redact_params(args):
+    """Describe parameters by type only so values never reach the logs"""
+    if args is None:
+        return []
+    if isinstance(args, dict):
+        return {key: f'<{type(value).__name__}>' for key, value in args.items()}
+    return [f'<{type(value).__name__}>' for value in args]
+
+
+def plan_issues(plan, limited=False):
+    """Flag full table/index scans and filesorts in EXPLAIN rows
+
+    An unfiltered index scan on a statement with LIMIT stops after LIMIT rows (e.g. ORDER BY id DESC
+    LIMIT 50) and is not flagged; with "Using where" it may still read the whole index.
+    """
+    issues = []
+    for row in plan:
+        table = row.get('table')
+        extra = row.get('Extra') or ''
+        if row.get('type') == 'ALL':
+            issues.append(f'full table scan on {table}')
+        elif row.get('type') == 'index' and not (limited and 'Using where' not in extra):
+            issues.append(f'full index scan on {table}')
+        if 'Using filesort' in extra:
+            issues.append(f'filesort on {table}')
+    return issues
+
+
+class ObservedCursor(Cursor):
+    """Cursor that times every statement, logs slow ones and explains new fingerprints"""
+
+    def execute(self, query, args=None):
+        start = time.perf_counter()
+        result = super().execute(query, args)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        # Observability must never break the statement that already ran
+        try:
+            record_query(self.connection, query, args, elapsed_ms)
+        except Exception:
+            app.logger.exception('Could not record query statistics')
+        return result
+
+
+def record_query(connection, query, args, elapsed_ms):
+    fingerprint, normalized = fingerprint_query(query)
+
+    with query_stats_lock:
+        stats = query_stats.get(fingerprint)
+        if stats is None:
+            stats = query_stats[fingerprint] = {
+                'fingerprint': fingerprint,
+                'query': normalized,
+                'count': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'slow_count': 0,
+                'plan': None,
+                'issues': [],
+                'explain_attempts': 0,
+            }
+        stats['count'] += 1
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        if elapsed_ms >= app.config['SLOW_QUERY_MS']:
+            stats['slow_count'] += 1
+        # Explain each fingerprint once; failed attempts are retried on later executions
+        explain = (
+            app.config['QUERY_EXPLAIN'] and
+            stats['plan'] is None and
+            stats['explain_attempts'] < app.config['QUERY_EXPLAIN_ATTEMPTS'] and
+            normalized.split(' ', 1)[0].upper() in ['SELECT', 'UPDATE', 'DELETE']
+        )
+        if explain:
+            stats['explain_attempts'] += 1
+
+    if elapsed_ms >= app.config['SLOW_QUERY_MS']:
+        app.logger.warning(
+            'Slow query [%s] %.1f ms: %s params=%s',
+            fingerprint, elapsed_ms, normalized, redact_params(args)
+        )
+
+    if explain:
+        explain_query(connection, fingerprint, normalized, query, args)
+
+
+def explain_query(connection, fingerprint, normalized, query, args):
+    """Run EXPLAIN for a newly seen statement and store the plan and any issues"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', errors='replace')
+    try:
+        # Plain cursor so the EXPLAIN itself is not observed
+        cur = connection.cursor(Cursor)
+        cur.execute('EXPLAIN ' + query, args)
+        columns = [column[0] for column in cur.description]
+        plan = [dict(zip(columns, row)) for row in cur.fetchall()]
+        cur.close()
+    except Exception as e:
+        app.logger.debug('EXPLAIN failed for [%s]: %s', fingerprint, e)
+        return
+
+    issues = plan_issues(plan, limited=re.search(r'\bLIMIT\b', normalized, re.IGNORECASE) is not None)
+    with query_stats_lock:
+        query_stats[fingerprint]['plan'] = plan
+        query_stats[fingerprint]['issues'] = issues
+
+    if issues:
+        app.logger.warning(
+            'Query plan issues [%s] %s: %s',
+            fingerprint, ', '.join(issues), normalized
+        )
+
+
+def get_cursor():
+    """Cursor on the current MySQL connection with query observability enabled"""
+    return mysql.connection.cursor(ObservedCursor)
+
 
 # Decorator to require login
 def login_required(f):
@@ -50,7 +213,7 @@ def login():
             return render_template('login.html')
 
         # Query admin user
-        cur = mysql.connection.cursor()
+        cur = get_cursor()
         cur.execute("SELECT id, username, password FROM admin_users WHERE username = %s", (username,))
         user = cur.fetchone()
         cur.close()
@@ -79,7 +242,7 @@ def logout():
 @login_required
 def dashboard():
     """Dashboard with user list"""
-    cur = mysql.connection.cursor()
+    cur = get_cursor()
     cur.execute("SELECT id, nombre, email, rol, created_at FROM users ORDER BY id DESC")
     users = cur.fetchall()
     cur.close()
@@ -106,7 +269,7 @@ def create_user():
             return render_template('create_user.html')
 
         try:
-            cur = mysql.connection.cursor()
+            cur = get_cursor()
             cur.execute(
                 "INSERT INTO users (nombre, email, rol) VALUES (%s, %s, %s)",
                 (nombre, email, rol)
@@ -126,7 +289,7 @@ def create_user():
 @login_required
 def edit_user(user_id):
     """Edit existing user"""
-    cur = mysql.connection.cursor()
+    cur = get_cursor()
 
     if request.method == 'POST':
         nombre = request.form.get('nombre', '').strip()
@@ -179,7 +342,7 @@ def edit_user(user_id):
 def delete_user(user_id):
     """Delete user"""
     try:
-        cur = mysql.connection.cursor()
+        cur = get_cursor()
         cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
         mysql.connection.commit()
         cur.close()
@@ -190,5 +353,359 @@ def delete_user(user_id):
     return redirect(url_for('dashboard'))
 
 
+# =============================================================================
+# Background jobs
+# =============================================================================
+
+class JobCancelled(Exception):
+    """Raised inside a job when an admin has requested its cancellation"""
+
+
+class JobContext:
+    """Handle passed to job functions to report progress and check cancellation"""
+
+    def __init__(self, job_id, params):
+        self.job_id = job_id
+        self.params = params
+        self.progress = 0
+        self.total = 0
+
+    def set_total(self, total):
+        self.total = total
+        cur = get_cursor()
+        cur.execute("UPDATE jobs SET total = %s WHERE id = %s", (total, self.job_id))
+        mysql.connection.commit()
+        cur.close()
+
+    def set_progress(self, progress):
+        """Store progress and raise JobCancelled if cancellation was requested"""
+        self.progress = progress
+        cur = get_cursor()
+        cur.execute("UPDATE jobs SET progress = %s WHERE id = %s", (progress, self.job_id))
+        mysql.connection.commit()
+        if app.config['JOBS_BATCH_DELAY']:
+            time.sleep(app.config['JOBS_BATCH_DELAY'])
+        # Once all the work is done a late cancel request no longer applies
+        if progress >= self.total:
+            cur.close()
+            return
+        cur.execute("SELECT cancel_requested FROM jobs WHERE id = %s", (self.job_id,))
+        row = cur.fetchone()
+        cur.close()
+        if row and row[0]:
+            raise JobCancelled()
+
+
+def job_export_users(ctx):
+    """Export all users to CSV, reading the table in id-ordered batches"""
+    batch_size = app.config['JOBS_BATCH_SIZE']
+    cur = get_cursor()
+    cur.execute("SELECT COUNT(*) FROM users")
+    ctx.set_total(cur.fetchone()[0])
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['id', 'nombre', 'email', 'rol', 'created_at'])
+
+    last_id = 0
+    done = 0
+    while True:
+        cur.execute(
+            "SELECT id, nombre, email, rol, created_at FROM users WHERE id > %s ORDER BY id LIMIT %s",
+            (last_id, batch_size)
+        )
+        rows = cur.fetchall()
+        if not rows:
+            break
+        writer.writerows(rows)
+        last_id = rows[-1][0]
+        done += len(rows)
+        ctx.set_progress(done)
+    cur.close()
+
+    return output.getvalue()
+
+
+def job_bulk_update_rol(ctx):
+    """Change the role of every user from one value to another, in committed batches"""
+    from_rol = ctx.params.get('from_rol')
+    to_rol = ctx.params.get('to_rol')
+    if from_rol not in ['admin', 'usuario'] or to_rol not in ['admin', 'usuario']:
+        raise ValueError('El rol debe ser "admin" o "usuario".')
+
+    batch_size = app.config['JOBS_BATCH_SIZE']
+    cur = get_cursor()
+    cur.execute("SELECT COUNT(*) FROM users WHERE rol = %s", (from_rol,))
+    ctx.set_total(cur.fetchone()[0])
+
+    last_id = 0
+    done = 0
+    while True:
+        cur.execute(
+            "SELECT id FROM users WHERE rol = %s AND id > %s ORDER BY id LIMIT %s",
+            (from_rol, last_id, batch_size)
+        )
+        ids = [row[0] for row in cur.fetchall()]
+        if not ids:
+            break
+        cur.execute(
+            "UPDATE users SET rol = %s WHERE id IN %s AND rol = %s",
+            (to_rol, ids, from_rol)
+        )
+        mysql.connection.commit()
+        last_id = ids[-1]
+        done += cur.rowcount
+        ctx.set_progress(done)
+    cur.close()
+
+    return f'{done} usuarios actualizados de "{from_rol}" a "{to_rol}".'
+
+
+# Registered job types: tipo -> (label, function)
+JOB_TYPES = {
+    'export_users': ('Exportar usuarios a CSV', job_export_users),
+    'bulk_update_rol': ('Cambio masivo de rol', job_bulk_update_rol),
+}
+
+
+def _finish_job(job_id, status, result=None, error=None):
+    cur = get_cursor()
+    cur.execute(
+        "UPDATE jobs SET status = %s, result = %s, error = %s, finished_at = NOW() WHERE id = %s",
+        (status, result, error, job_id)
+    )
+    mysql.connection.commit()
+    cur.close()
+
+
+def run_job(job_id):
+    """Worker entry point: executes a queued job inside its own app context"""
+    with app.app_context():
+        cur = get_cursor()
+        # Claim the job; a job cancelled while still queued is skipped
+        cur.execute(
+            "UPDATE jobs SET status = 'running', started_at = NOW() WHERE id = %s AND status = 'pending'",
+            (job_id,)
+        )
+        mysql.connection.commit()
+        if cur.rowcount == 0:
+            cur.close()
+            return
+        cur.execute("SELECT tipo, params FROM jobs WHERE id = %s", (job_id,))
+        tipo, params = cur.fetchone()
+        cur.close()
+
+        ctx = JobContext(job_id, json.loads(params) if params else {})
+        try:
+            result = JOB_TYPES[tipo][1](ctx)
+            _finish_job(job_id, 'completed', result=result)
+        except JobCancelled:
+            mysql.connection.rollback()
+            _finish_job(
+                job_id, 'cancelled',
+                error=f'Cancelada tras procesar {ctx.progress} de {ctx.total} registros; '
+                      'los lotes ya procesados se mantienen.'
+            )
+        except Exception as e:
+            mysql.connection.rollback()
+            app.logger.exception('Job %s failed', job_id)
+            _finish_job(job_id, 'failed', error=str(e))
+
+
+def enqueue_job(tipo, params=None):
+    """Record a pending job and hand it to the worker pool, returning its id"""
+    cur = get_cursor()
+    cur.execute(
+        "INSERT INTO jobs (tipo, params, created_by) VALUES (%s, %s, %s)",
+        (tipo, json.dumps(params or {}), session.get('username'))
+    )
+    mysql.connection.commit()
+    job_id = cur.lastrowid
+    cur.close()
+
+    job_executor.submit(run_job, job_id)
+    return job_id
+
+
+# Only definition of the jobs schema; database/init.sql defers to init_jobs()
+JOBS_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    params TEXT,
+    status ENUM('pending', 'running', 'completed', 'failed', 'cancelled') DEFAULT 'pending',
+    progress INT DEFAULT 0,
+    total INT DEFAULT 0,
+    cancel_requested BOOLEAN DEFAULT FALSE,
+    result MEDIUMTEXT,
+    error TEXT,
+    created_by VARCHAR(50),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP NULL,
+    finished_at TIMESTAMP NULL,
+    INDEX idx_jobs_status (status)
+)
+"""
+
+
+def init_jobs():
+    """Create the jobs table on existing databases and fail jobs left pending/running by a previous process"""
+    with app.app_context():
+        cur = get_cursor()
+        cur.execute(JOBS_TABLE_DDL)
+        cur.execute(
+            "UPDATE jobs SET status = 'failed', error = %s, finished_at = NOW() "
+            "WHERE status IN ('pending', 'running')",
+            ('Interrumpido por reinicio del servidor.',)
+        )
+        mysql.connection.commit()
+        cur.close()
+
+
+def job_to_dict(job):
+    return {
+        'id': job[0],
+        'tipo': job[1],
+        'label': JOB_TYPES.get(job[1], (job[1],))[0],
+        'status': job[2],
+        'progress': job[3],
+        'total': job[4],
+        'error': job[5],
+        'created_by': job[6],
+        'created_at': job[7].strftime('%Y-%m-%d %H:%M:%S') if job[7] else None,
+        'finished_at': job[8].strftime('%Y-%m-%d %H:%M:%S') if job[8] else None,
+    }
+
+
+JOB_COLUMNS = "id, tipo, status, progress, total, error, created_by, created_at, finished_at"
+
+
+@app.route('/jobs')
+@login_required
+def jobs():
+    """Background jobs dashboard"""
+    cur = get_cursor()
+    cur.execute(f"SELECT {JOB_COLUMNS} FROM jobs ORDER BY id DESC LIMIT 50")
+    job_list = [job_to_dict(job) for job in cur.fetchall()]
+    cur.close()
+
+    return render_template('jobs.html', jobs=job_list, job_types=JOB_TYPES)
+
+
+@app.route('/jobs/start/<tipo>', methods=['POST'])
+@login_required
+def start_job(tipo):
+    """Queue a background job and return immediately"""
+    if tipo not in JOB_TYPES:
+        flash('Tipo de tarea desconocido.', 'danger')
+        return redirect(url_for('jobs'))
+
+    params = {}
+    if tipo == 'bulk_update_rol':
+        params = {
+            'from_rol': request.form.get('from_rol', ''),
+            'to_rol': request.form.get('to_rol', ''),
+        }
+        if params['from_rol'] not in ['admin', 'usuario'] or params['to_rol'] not in ['admin', 'usuario']:
+            flash('El rol debe ser "admin" o "usuario".', 'danger')
+            return redirect(url_for('jobs'))
+
+    try:
+        job_id = enqueue_job(tipo, params)
+        flash(f'Tarea #{job_id} en cola.', 'success')
+    except Exception as e:
+        flash(f'Error al crear la tarea: {str(e)}', 'danger')
+
+    return redirect(url_for('jobs'))
+
+
+@app.route('/jobs/<int:job_id>/status')
+@login_required
+def job_status(job_id):
+    """Job progress as JSON, polled by the jobs dashboard"""
+    cur = get_cursor()
+    cur.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = %s", (job_id,))
+    job = cur.fetchone()
+    cur.close()
+
+    if not job:
+        return jsonify({'error': 'Tarea no encontrada.'}), 404
+
+    return jsonify(job_to_dict(job))
+
+
+@app.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    """Request cancellation; queued jobs are cancelled at once, running ones at their next checkpoint"""
+    cur = get_cursor()
+    cur.execute(
+        "UPDATE jobs SET status = 'cancelled', cancel_requested = TRUE, finished_at = NOW() "
+        "WHERE id = %s AND status = 'pending'",
+        (job_id,)
+    )
+    if cur.rowcount == 0:
+        cur.execute(
+            "UPDATE jobs SET cancel_requested = TRUE WHERE id = %s AND status = 'running'",
+            (job_id,)
+        )
+    mysql.connection.commit()
+    cancelled = cur.rowcount > 0
+    cur.close()
+
+    if cancelled:
+        flash(f'Cancelación de la tarea #{job_id} solicitada.', 'info')
+    else:
+        flash('La tarea ya ha finalizado o no existe.', 'warning')
+
+    return redirect(url_for('jobs'))
+
+
+@app.route('/jobs/<int:job_id>/result')
+@login_required
+def job_result(job_id):
+    """Download the result of a completed job"""
+    cur = get_cursor()
+    cur.execute("SELECT tipo, status, result FROM jobs WHERE id = %s", (job_id,))
+    job = cur.fetchone()
+    cur.close()
+
+    if not job or job[1] != 'completed':
+        flash('La tarea no existe o no ha finalizado.', 'warning')
+        return redirect(url_for('jobs'))
+
+    if job[0] == 'export_users':
+        return Response(
+            job[2],
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=usuarios_{job_id}.csv'}
+        )
+
+    return Response(job[2] or '', mimetype='text/plain')
+
+
+@app.route('/queries/report')
+@login_required
+def query_report():
+    """Per-fingerprint query statistics and flagged plans, slowest first"""
+    with query_stats_lock:
+        report = [dict(stats, plan=[
+            {key: str(value) if value is not None else None for key, value in row.items()}
+            for row in stats['plan'] or []
+        ]) for stats in query_stats.values()]
+
+    report.sort(key=lambda stats: stats['max_ms'], reverse=True)
+    return jsonify({
+        'slow_query_ms': app.config['SLOW_QUERY_MS'],
+        'explain_enabled': app.config['QUERY_EXPLAIN'],
+        'queries': report,
+        'flagged': [stats for stats in report if stats['issues']],
+    })
+
+
 if __name__ == '__main__':
+    try:
+        init_jobs()
+    except Exception:
+        app.logger.exception('No se pudo inicializar la tabla de tareas')
     app.run(host='0.0.0.0', port=5000, debug=True)
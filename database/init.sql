@@ -20,6 +20,9 @@ CREATE TABLE IF NOT EXISTS users (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
 );
 
+-- The jobs table (background operations) is created by the application at
+-- startup: see JOBS_TABLE_DDL / init_jobs() in app.py
+
 -- Insert default admin user (username: admin, password: admin123)
 -- Password will be hashed by the application
 -- For now using pbkdf2:sha256 hash of 'admin123'
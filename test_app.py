@@ -2,8 +2,11 @@
 Comprehensive tests for Flask User Management Application
 Tests all authentication and CRUD operations
 """
+import html
 import requests
+import re
 import sys
+import time
 from datetime import datetime
 
 # Configuration
@@ -11,6 +14,17 @@ BASE_URL = "http://127.0.0.1:5001"
 ADMIN_USERNAME = "admin"
 ADMIN_PASSWORD = "admin123"
 
+# Statements whose flagged plans are known and accepted (normalized query -> reason).
+# Any other flagged statement in /queries/report fails the query observability test.
+KNOWN_PLAN_ISSUES = {
+    "SELECT id, nombre, email, rol, created_at FROM users ORDER BY id DESC":
+        "dashboard lists every user by design; there is no filter an index could serve",
+    "SELECT COUNT(*) FROM users":
+        "export job total, once per job; InnoDB has to scan an index for an exact count",
+    "SELECT COUNT(*) FROM users WHERE rol = ?":
+        "bulk role change total, once per job; rol has two values, an index would not be selective",
+}
+
 # ANSI color codes for terminal output
 GREEN = '\033[92m'
 RED = '\033[91m'
@@ -417,6 +431,234 @@ class TestRunner:
             self.log_test("Test 6.1: Logout functionality", False, f"(Error: {str(e)})")
             return False
 
+    # =========================================================================
+    # TEST 7: Background Jobs
+    # (run with docker-compose.test.yml: one worker, one-row batches, 1 s per batch)
+    # =========================================================================
+
+    def start_job(self, tipo, data=None):
+        """Queue a background job and return its id (None if it was not queued)"""
+        response = self.session.post(f"{BASE_URL}/jobs/start/{tipo}", data=data, allow_redirects=True)
+        match = re.search(r"Tarea #(\d+) en cola", response.text)
+        return match.group(1) if match else None
+
+    def wait_for_job(self, job_id, until=None):
+        """Poll a job's status until `until(job)` holds (default: job finished) and return it"""
+        until = until or (lambda job: job.get("status") not in ["pending", "running"])
+        job = {}
+        for _ in range(120):
+            job = self.session.get(f"{BASE_URL}/jobs/{job_id}/status").json()
+            if until(job):
+                break
+            time.sleep(0.5)
+        return job
+
+    def dashboard_users(self):
+        """Return (id, nombre, email, rol) for every user listed in the dashboard"""
+        response = self.session.get(f"{BASE_URL}/dashboard")
+        rows = re.findall(
+            r'<td>(\d+)</td>\s*<td>(.*?)</td>\s*<td>(.*?)</td>\s*<td>\s*<span class="badge bg-(danger|secondary)">',
+            response.text
+        )
+        return [
+            (user_id, html.unescape(nombre), html.unescape(email), "admin" if badge == "danger" else "usuario")
+            for user_id, nombre, email, badge in rows
+        ]
+
+    def test_jobs_page_accessible(self):
+        """Test 7.1: JOBS - Verify jobs dashboard is accessible"""
+        try:
+            response = self.session.get(f"{BASE_URL}/jobs")
+            success = response.status_code == 200 and "Tareas" in response.text
+            self.log_test(
+                "Test 7.1: JOBS - Dashboard accessible",
+                success,
+                f"(Status: {response.status_code})"
+            )
+            return success
+        except Exception as e:
+            self.log_test("Test 7.1: JOBS - Dashboard accessible", False, f"(Error: {str(e)})")
+            return False
+
+    def test_export_job_completes(self):
+        """Test 7.2: JOBS - Verify export job returns immediately and completes"""
+        try:
+            job_id = self.start_job("export_users")
+            if not job_id:
+                self.log_test("Test 7.2: JOBS - Export job completes", False, "(Job was not queued)")
+                return False
+
+            job = self.wait_for_job(job_id)
+            result = self.session.get(f"{BASE_URL}/jobs/{job_id}/result")
+            success = (
+                job.get("status") == "completed" and
+                result.status_code == 200 and
+                "juan.perez@example.com" in result.text
+            )
+            self.log_test(
+                "Test 7.2: JOBS - Export job completes",
+                success,
+                f"(Job: {job_id}, Status: {job.get('status')})"
+            )
+            return success
+        except Exception as e:
+            self.log_test("Test 7.2: JOBS - Export job completes", False, f"(Error: {str(e)})")
+            return False
+
+    def test_cancel_queued_job(self):
+        """Test 7.3: JOBS - Verify a queued job is cancelled before it starts"""
+        try:
+            # The single worker is busy with the first job, so the second stays queued
+            busy_id = self.start_job("export_users")
+            job_id = self.start_job("export_users")
+            if not busy_id or not job_id:
+                self.log_test("Test 7.3: JOBS - Cancel queued job", False, "(Job was not queued)")
+                return False
+
+            self.session.post(f"{BASE_URL}/jobs/{job_id}/cancel")
+            job = self.wait_for_job(job_id)
+            success = job.get("status") == "cancelled" and job.get("progress") == 0
+
+            # Free the worker for the next tests
+            self.session.post(f"{BASE_URL}/jobs/{busy_id}/cancel")
+            self.wait_for_job(busy_id)
+
+            self.log_test(
+                "Test 7.3: JOBS - Cancel queued job",
+                success,
+                f"(Job: {job_id}, Status: {job.get('status')})"
+            )
+            return success
+        except Exception as e:
+            self.log_test("Test 7.3: JOBS - Cancel queued job", False, f"(Error: {str(e)})")
+            return False
+
+    def test_cancel_running_job(self):
+        """Test 7.4: JOBS - Verify a running job stops at its next batch when cancelled"""
+        try:
+            job_id = self.start_job("export_users")
+            if not job_id:
+                self.log_test("Test 7.4: JOBS - Cancel running job", False, "(Job was not queued)")
+                return False
+
+            self.wait_for_job(job_id, until=lambda job: job.get("progress", 0) >= 1)
+            self.session.post(f"{BASE_URL}/jobs/{job_id}/cancel")
+            job = self.wait_for_job(job_id)
+            success = (
+                job.get("status") == "cancelled" and
+                0 < job.get("progress", 0) < job.get("total", 0)
+            )
+            self.log_test(
+                "Test 7.4: JOBS - Cancel running job",
+                success,
+                f"(Job: {job_id}, Status: {job.get('status')}, "
+                f"Progress: {job.get('progress')}/{job.get('total')})"
+            )
+            return success
+        except Exception as e:
+            self.log_test("Test 7.4: JOBS - Cancel running job", False, f"(Error: {str(e)})")
+            return False
+
+    def test_bulk_update_rol_job(self):
+        """Test 7.5: JOBS - Verify bulk role change updates every matching user"""
+        test_time = datetime.now().strftime("%Y%m%d%H%M%S")
+        test_emails = [f"bulk{i}_{test_time}@example.com" for i in range(2)]
+        usuarios = []
+        try:
+            for i, email in enumerate(test_emails):
+                self.session.post(
+                    f"{BASE_URL}/user/create",
+                    data={"nombre": f"Bulk User {i} {test_time}", "email": email, "rol": "usuario"}
+                )
+            usuarios = [user for user in self.dashboard_users() if user[3] == "usuario"]
+
+            job_id = self.start_job("bulk_update_rol", {"from_rol": "usuario", "to_rol": "admin"})
+            if not job_id:
+                self.log_test("Test 7.5: JOBS - Bulk role change", False, "(Job was not queued)")
+                return False
+            job = self.wait_for_job(job_id)
+
+            after = self.dashboard_users()
+            test_roles = [user[3] for user in after if user[2] in test_emails]
+            success = (
+                job.get("status") == "completed" and
+                job.get("progress") == job.get("total") == len(usuarios) and
+                test_roles == ["admin", "admin"] and
+                all(user[3] == "admin" for user in after)
+            )
+            self.log_test(
+                "Test 7.5: JOBS - Bulk role change",
+                success,
+                f"(Job: {job_id}, Status: {job.get('status')}, "
+                f"Progress: {job.get('progress')}/{job.get('total')})"
+            )
+            return success
+        except Exception as e:
+            self.log_test("Test 7.5: JOBS - Bulk role change", False, f"(Error: {str(e)})")
+            return False
+        finally:
+            # Restore the users that were "usuario" and remove the test users
+            for user_id, nombre, email, _ in usuarios:
+                if email in test_emails:
+                    self.session.post(f"{BASE_URL}/user/delete/{user_id}")
+                else:
+                    self.session.post(
+                        f"{BASE_URL}/user/edit/{user_id}",
+                        data={"nombre": nombre, "email": email, "rol": "usuario"}
+                    )
+
+    # =========================================================================
+    # TEST 8: Query Observability
+    # =========================================================================
+
+    def test_query_report(self):
+        """Test 8.1: QUERIES - Verify query report captures plans for issued statements"""
+        try:
+            self.session.get(f"{BASE_URL}/dashboard")
+            response = self.session.get(f"{BASE_URL}/queries/report")
+            report = response.json()
+            dashboard_queries = [
+                q for q in report["queries"]
+                if q["query"].startswith("SELECT id, nombre, email, rol, created_at FROM users ORDER BY")
+            ]
+            success = response.status_code == 200 and len(dashboard_queries) == 1
+            if success and report["explain_enabled"]:
+                success = bool(dashboard_queries[0]["plan"])
+            self.log_test(
+                "Test 8.1: QUERIES - Report captures statements",
+                success,
+                f"(Statements: {len(report['queries'])}, Explain: {report['explain_enabled']})"
+            )
+            return success
+        except Exception as e:
+            self.log_test("Test 8.1: QUERIES - Report captures statements", False, f"(Error: {str(e)})")
+            return False
+
+    def test_no_new_plan_issues(self):
+        """Test 8.2: QUERIES - Verify no flagged plan outside KNOWN_PLAN_ISSUES"""
+        try:
+            report = self.session.get(f"{BASE_URL}/queries/report").json()
+            if not report["explain_enabled"]:
+                self.log_test(
+                    "Test 8.2: QUERIES - No new plan issues",
+                    False,
+                    "(Not run: QUERY_EXPLAIN is disabled; use docker-compose.test.yml)"
+                )
+                return False
+            regressions = [q for q in report["flagged"] if q["query"] not in KNOWN_PLAN_ISSUES]
+            for query in report["flagged"]:
+                color = YELLOW if query["query"] in KNOWN_PLAN_ISSUES else RED
+                print(f"  {color}!{RESET} [{query['fingerprint']}] {', '.join(query['issues'])}: {query['query']}")
+            self.log_test(
+                "Test 8.2: QUERIES - No new plan issues",
+                len(regressions) == 0,
+                f"(Flagged: {len(report['flagged'])}, New: {len(regressions)})"
+            )
+            return len(regressions) == 0
+        except Exception as e:
+            self.log_test("Test 8.2: QUERIES - No new plan issues", False, f"(Error: {str(e)})")
+            return False
+
     def run_all_tests(self):
         """Run all tests in order"""
         print(f"\n{YELLOW}{'*' * 60}{RESET}")
@@ -464,6 +706,23 @@ class TestRunner:
         )
         self.test_logout_functionality()
 
+        # Background Jobs Tests
+        self.log_section("7. BACKGROUND JOBS")
+        self.session.post(
+            f"{BASE_URL}/login",
+            data={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD}
+        )
+        self.test_jobs_page_accessible()
+        self.test_export_job_completes()
+        self.test_cancel_queued_job()
+        self.test_cancel_running_job()
+        self.test_bulk_update_rol_job()
+
+        # Query Observability Tests
+        self.log_section("8. QUERY OBSERVABILITY")
+        self.test_query_report()
+        self.test_no_new_plan_issues()
+
         # Summary
         self.log_summary()
 